@@ -1,5 +1,20 @@
+import functools
+import hashlib
 import random
 
+__all__ = ["BStarTree", "BStarTreeNode"]
+
+@functools.lru_cache(maxsize=65536)
+def zobrist_key(link: tuple) -> int:
+    """
+    @brief: Get the zobrist key of a (module, parent, side) tuple
+    @param: link -> (module name, parent name, side) of a node
+    @return: key -> 64-bit key derived from the tuple (same key in every process)
+    @addition: The keys are memoized in a bounded LRU cache
+    """
+    return int.from_bytes(hashlib.blake2b(repr(link).encode(), digest_size=8).digest(), "little")
+
+
 class BStarTreeNode:
     def __init__(self, name, width, height, pin=[]):
         self.name   = name
@@ -16,10 +31,42 @@ class BStarTreeNode:
         self.right  = None
         self.parent = None
 
+        self.key    = 0
+
 class BStarTree:
     def __init__(self):
         self.root = None
         self.h_contour = []
+        self.hash = 0
+
+        self.width  = 0
+        self.height = 0
+
+        # random seed of the annealing that produced the tree (None if unknown)
+        self.seed   = None
+
+
+    def rehash(self, *nodes: BStarTreeNode) -> None:
+        """
+        @brief: Update the zobrist hash of the tree after the links of the nodes changed
+        @param: nodes -> nodes whose (module, parent, side) tuple may have changed
+        """
+        for node in nodes:
+            if node is None:
+                continue
+
+            # get the (module, parent, side) tuple of the node
+            if node.parent is None:
+                link = (node.name, None, None)
+            elif node.parent.left is node:
+                link = (node.name, node.parent.name, "left")
+            else:
+                link = (node.name, node.parent.name, "right")
+
+            # replace the previous key of the node by the new one
+            key = zobrist_key(link)
+            self.hash ^= node.key ^ key
+            node.key = key
     
     def insert_root(self, new_node: BStarTreeNode) -> bool:
         """
@@ -29,6 +76,7 @@ class BStarTree:
         if self.root is None:
             self.root = new_node
             new_node.parent = None
+            self.rehash(new_node)
             return True
         else:
             return False
@@ -40,16 +88,19 @@ class BStarTree:
         @param: node -> new node inserted to the left of this node
         @param: new_node -> new node to be inserted
         """
-        if node.left is None:
+        _tmp_ = node.left
+
+        if _tmp_ is None:
             node.left = new_node
             new_node.parent = node
         else:
-            _tmp_ = node.left
             node.left = new_node
             new_node.parent = node
             new_node.left = _tmp_
             _tmp_.parent = new_node
 
+        self.rehash(new_node, _tmp_)
+
         return True
 
 
@@ -59,27 +110,31 @@ class BStarTree:
         @param: node -> new node inserted to the right of this node
         @param: new_node -> new node to be inserted
         """
-        if node.right is None:
+        _tmp_ = node.right
+
+        if _tmp_ is None:
             node.right = new_node
             new_node.parent = node
         else:
-            _tmp_ = node.right
             node.right = new_node
             new_node.parent = node
             new_node.right = _tmp_
             _tmp_.parent = new_node
 
+        self.rehash(new_node, _tmp_)
+
         return True
 
 
-    def insert_recursive(self, node: BStarTreeNode, new_node: BStarTreeNode) -> bool:
+    def insert_recursive(self, node: BStarTreeNode, new_node: BStarTreeNode, rng: random.Random=random) -> bool:
         """
         @brief: Insert module to the tree recursively
         @param: node -> current node
         @param: new_node -> new node to be inserted
+        @param: rng -> random generator (default: global random module)
         """
         if node.left is None and node.right is None:
-            if random.randint(0,1) == 0:
+            if rng.randint(0,1) == 0:
                 self.insert_left(node, new_node)
             else:
                 self.insert_right(node, new_node)
@@ -88,17 +143,21 @@ class BStarTree:
         elif node.right is None:
             self.insert_right(node, new_node)
         else:
-            if random.randint(0,1) == 0:
-                self.insert_recursive(node.left, new_node)
+            if rng.randint(0,1) == 0:
+                self.insert_recursive(node.left, new_node, rng)
             else:
-                self.insert_recursive(node.right, new_node)
+                self.insert_recursive(node.right, new_node, rng)
 
 
-    def delete(self, delete_node: BStarTreeNode) -> None:
+    def delete(self, delete_node: BStarTreeNode, rng: random.Random=random) -> None:
         """
         @brief: Delete module from the tree
         @param: delete_node -> node to be deleted
+        @param: rng -> random generator (default: global random module)
         """
+        left_node  = delete_node.left
+        right_node = delete_node.right
+
         # Case 1: delete node has no child
         if delete_node.left is None and delete_node.right is None:
             # delete node is the root
@@ -143,7 +202,7 @@ class BStarTree:
 
         # Case 3: delete node has two children
         elif delete_node.left is not None and delete_node.right is not None:
-            if random.randint(0,1) == 0:
+            if rng.randint(0,1) == 0:
                 replace_node = delete_node.left
                 another_node = delete_node.right
             else:
@@ -154,32 +213,35 @@ class BStarTree:
             if delete_node.parent is None:
                 self.root = None
                 self.insert_root(replace_node)
-                self.insert_recursive(replace_node, another_node)
+                self.insert_recursive(replace_node, another_node, rng)
             # delete node is the left node of the parent node
             elif delete_node.parent.left == delete_node:
                 delete_node.parent.left = None
                 self.insert_left(delete_node.parent, replace_node)
-                self.insert_recursive(replace_node, another_node)
+                self.insert_recursive(replace_node, another_node, rng)
             # delete node is the right node of the parent node
             elif delete_node.parent.right == delete_node:
                 delete_node.parent.right = None
                 self.insert_right(delete_node.parent, replace_node)
-                self.insert_recursive(replace_node, another_node)
+                self.insert_recursive(replace_node, another_node, rng)
 
         # Reset the delete node
         delete_node.parent = None
         delete_node.left = None
         delete_node.right = None
 
+        self.rehash(delete_node, left_node, right_node)
+
         
-    def move(self, from_node: BStarTreeNode, to_node: BStarTreeNode, direction: str) -> None:
+    def move(self, from_node: BStarTreeNode, to_node: BStarTreeNode, direction: str, rng: random.Random=random) -> None:
         """
         @brief: Move module from one place to another place
         @param: from_node -> source node
         @param: to_node -> destination node
         @param: direction -> direction of the movement (left or right)
+        @param: rng -> random generator (default: global random module)
         """
-        self.delete(from_node)
+        self.delete(from_node, rng)
         if direction == 'left':
             self.insert_left(to_node, from_node)
         elif direction == 'right':
@@ -200,6 +262,9 @@ class BStarTree:
         @param: node1 -> first node to be swapped
         @param: node2 -> second node to be swapped
         """
+        # nodes whose (module, parent, side) tuple changes
+        nodes = [node1, node2, node1.left, node1.right, node2.left, node2.right]
+
         # get information
         _tmp_name_ = node1.name
         _tmp_width_ = node1.width
@@ -226,15 +291,19 @@ class BStarTree:
         node2.x = _tmp_x_
         node2.y = _tmp_y_
 
+        self.rehash(*nodes)
+
 
-    def update_coordinates(self, node: BStarTreeNode) -> None:
+    def update_coordinates(self, node: BStarTreeNode, max_area: float=float('inf')) -> bool:
         """
         @brief: Update all block coordinates after certain operation (move, rotate, swap, etc.)
         @param: node -> B*-tree node
+        @param: max_area -> stop once the area of the packed modules exceeds it (default: no limit)
+        @return: True if all the modules are packed, False if stopped by max_area
         @addition: Update the pin coordinates
         """
         if node is None:
-            return
+            return True
 
         # reset pin coordinates
         for pin in node.pin:
@@ -290,15 +359,24 @@ class BStarTree:
         # add new point if contour is short than the node
         if node.x + node.width > self.h_contour[-1][0]:
             self.h_contour.append([node.x + node.width, node.y])
+
+        # update the width and height of the packed modules (lower bound of the floorplan)
+        self.width  = max(self.width, node.x + node.width)
+        self.height = max(self.height, node.y + node.height)
+
+        # stop packing if the area bound is exceeded
+        if self.width * self.height > max_area:
+            return False
         
         # update the left and right child coordinates
-        self.update_coordinates(node.left)
-        self.update_coordinates(node.right)
+        return self.update_coordinates(node.left, max_area) and self.update_coordinates(node.right, max_area)
     
 
-    def update_floorplan(self) -> None:
+    def update_floorplan(self, max_area: float=float('inf')) -> bool:
         """
         @brief: Update the floorplan
+        @param: max_area -> stop once the area of the packed modules exceeds it (default: no limit)
+        @return: True if all the modules are packed, False if stopped by max_area
         @addition: Update the pin coordinates
         """
         # reset root pin coordinates
@@ -312,10 +390,11 @@ class BStarTree:
         self.root.x = 0
         self.root.y = 0
         self.h_contour = [[0,self.root.height], [self.root.width, 0]]
+        self.width  = self.root.width
+        self.height = self.root.height
 
         # update contour and coordinates
-        self.update_coordinates(self.root.left)
-        self.update_coordinates(self.root.right)
+        return self.update_coordinates(self.root.left, max_area) and self.update_coordinates(self.root.right, max_area)
 
 
     def get_modules(self, node: BStarTreeNode="root") -> list:
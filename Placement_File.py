@@ -0,0 +1,170 @@
+from Module.DB import *
+from Device_Placer.BStarTree import BStarTree, BStarTreeNode
+from Device_Placer import Simulated_Annealing as sa
+from Device_Placer import Placer
+import mmap
+import struct
+
+__all__ = ["write_placement", "read_placement", "load_placement"]
+
+# file layout (little-endian):
+#   header  -> magic, version, flags, number of groups, number of ports,
+#              floorplan width, floorplan height, cost, seed
+#   groups  -> name offset, name length, x, y, width, height, orientation
+#   ports   -> name offset, name length, x0, y0, x1, y1 (metal1 box)
+#   strings -> utf-8 names, offsets relative to the start of the strings
+MAGIC   = b"DPLR"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHIIdddq")
+GROUP  = struct.Struct("<IIddddI")
+PORT   = struct.Struct("<IIdddd")
+
+# flags of the header
+FLAG_SEED = 0x1
+
+# orientation of the groups (rotation is not supported by the B*-tree yet)
+ORIENTATION = ["R0"]
+
+
+def write_placement(path: str, tree: BStarTree, circuit: Circuit=None, cost: float=None, seed: int=None) -> None:
+    """
+    @brief: Write the placement result to a binary file
+    @param: path -> path of the placement file
+    @param: tree -> final state of the floorplan (B*-tree)
+    @param: circuit -> Circuit object, the metal1 boxes of its ports are written (default: no ports)
+    @param: cost -> cost of the floorplan (default: cost of the tree)
+    @param: seed -> random seed of the placement (default: tree.seed, no seed if unknown)
+    """
+    ports = circuit.port if circuit is not None else {}
+
+    # the seed is stored as a signed 64-bit integer
+    if seed is None:
+        seed = tree.seed
+    if seed is not None and not -2**63 <= seed < 2**63:
+        raise ValueError(f"seed {seed} does not fit in a signed 64-bit integer")
+
+    # calculate the cost of the floorplan (also packs the tree)
+    if cost is None:
+        cost = sa.sa_cost(tree, ports)
+    else:
+        tree.update_floorplan()
+
+    strings = bytearray()
+    groups  = bytearray()
+    boxes   = bytearray()
+
+    # pack the groups
+    modules = tree.get_modules()
+    for module in modules:
+        name = module.name.encode()
+        groups += GROUP.pack(len(strings), len(name), module.x, module.y, module.width, module.height, 0)
+        strings += name
+
+    # pack the metal1 boxes of the placed ports
+    count = 0
+    for name in ports:
+        if "metal1" not in ports[name].shape:
+            continue
+
+        box  = ports[name].shape["metal1"][0]
+        name = name.encode()
+        boxes += PORT.pack(len(strings), len(name), box.x[0], box.y[0], box.x[1], box.y[1])
+        strings += name
+        count += 1
+
+    # pack the header
+    flags  = FLAG_SEED if seed is not None else 0
+    header = HEADER.pack(MAGIC, VERSION, flags, len(modules), count, tree.width, tree.height, cost, seed or 0)
+
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(groups)
+        f.write(boxes)
+        f.write(strings)
+
+
+def read_placement(path: str) -> dict:
+    """
+    @brief: Read the placement result from a binary file
+    @param: path -> path of the placement file
+    @return: placement -> {"width", "height", "cost", "seed",
+                           "groups": [(name, x, y, width, height, orientation)],
+                           "ports": {name: [x0, y0, x1, y1]}}
+    @addition: Integral coordinates are read back as int
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        # unpack the header
+        magic, version, flags, n_group, n_port, width, height, cost, seed = HEADER.unpack_from(data, 0)
+
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a placement file")
+        if version != VERSION:
+            raise ValueError(f"{path} has unsupported placement file version {version}")
+
+        # offsets of the sections
+        group_offset  = HEADER.size
+        port_offset   = group_offset + n_group * GROUP.size
+        string_offset = port_offset + n_port * PORT.size
+
+        placement = {
+            "width":  as_number(width),
+            "height": as_number(height),
+            "cost":   cost,
+            "seed":   seed if flags & FLAG_SEED else None,
+            "groups": [],
+            "ports":  {},
+        }
+
+        # unpack the groups
+        for i in range(n_group):
+            start, length, x, y, w, h, orientation = GROUP.unpack_from(data, group_offset + i * GROUP.size)
+            name = data[string_offset + start:string_offset + start + length].decode()
+            placement["groups"].append((name, as_number(x), as_number(y), as_number(w), as_number(h), ORIENTATION[orientation]))
+
+        # unpack the ports
+        for i in range(n_port):
+            start, length, x0, y0, x1, y1 = PORT.unpack_from(data, port_offset + i * PORT.size)
+            name = data[string_offset + start:string_offset + start + length].decode()
+            placement["ports"][name] = [as_number(x0), as_number(y0), as_number(x1), as_number(y1)]
+
+    return placement
+
+
+def load_placement(path: str, circuit: Circuit) -> dict:
+    """
+    @brief: Apply a placement file onto an unplaced circuit (no annealing)
+    @param: path -> path of the placement file
+    @param: circuit -> Circuit object
+    @return: placement -> content of the placement file (see read_placement)
+    """
+    placement = read_placement(path)
+
+    # get the placed modules
+    modules = []
+    for name, x, y, width, height, orientation in placement["groups"]:
+        module = BStarTreeNode(name, width, height)
+        module.x = x
+        module.y = y
+        modules.append(module)
+
+    # update the instance layout
+    Placer.update_layout(circuit, modules)
+    circuit.width  = placement["width"]
+    circuit.height = placement["height"]
+
+    # update the port shape
+    for name, (x0, y0, x1, y1) in placement["ports"].items():
+        circuit.port[name].shape["m1_text"] = [Text("m1_text", [(x0 + x1)/2, (y0 + y1)/2], name)]
+        circuit.port[name].shape["metal1"] = [Box("metal1", [x0, y0], [x1, y1])]
+
+    return placement
+
+
+def as_number(value: float):
+    """
+    @brief: Convert an integral float back to int
+    @param: value -> float value
+    @return: value -> int if the value is integral, else the float value
+    """
+    return int(value) if value.is_integer() else value
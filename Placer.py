@@ -1,13 +1,285 @@
 from Module.DB import *
-from Device_Placer import BStarTreeNode
+from Device_Placer import BStarTree, BStarTreeNode
 from Device_Placer import Simulated_Annealing as sa 
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import collections
 import copy
+import logging
+import os
+import random
+import time
 
-def device_placement(circuit: Circuit) -> None:
+__all__ = ["device_placement", "async_device_placement", "batch_placement", "placement_job", "port_placement"]
+
+logger = logging.getLogger(__name__)
+
+# annealing schedule (tuned for the shelf-packed initial floorplan)
+INIT_TEMP = 20
+STOP_TEMP = 1
+ITERATION = 5000
+
+def device_placement(circuit: Circuit, time_budget: float=None, cache_size: int=4096, seed: int=None, init_method: str="shelf") -> BStarTree:
     """
     @brief: device placement of the instance
+    @param: circuit -> Circuit object
+    @param: time_budget -> wall-clock budget of the annealing in seconds (default: no budget)
+    @param: cache_size -> number of evaluated states kept in the cost cache
+    @param: seed -> random seed of the annealing (default: a drawn seed, recorded in tree.seed)
+    @param: init_method -> constructive method of the initial floorplan (see sa.sa_initial_state)
+    @return: tree -> final state of the floorplan
+    """
+    modules, cache, seed, rng = placement_setup(circuit, cache_size, seed)
+
+    # placement of the modules
+    tree = sa.optimal_simulated_annealing(modules, circuit.port, INIT_TEMP, STOP_TEMP, ITERATION, time_budget, cache, init_method, rng)
+
+    return placement_finish(circuit, tree, cache, seed)
+
+
+async def async_device_placement(circuit: Circuit, time_budget: float=None, cache_size: int=4096, seed: int=None, executor=None, chunk: int=500, progress: asyncio.Queue=None, init_method: str="shelf") -> BStarTree:
+    """
+    @brief: device placement of the instance without blocking the event loop
+    @param: circuit -> Circuit object
+    @param: time_budget -> wall-clock budget of the annealing in seconds (default: no budget)
+    @param: cache_size -> number of evaluated states kept in the cost cache
+    @param: seed -> random seed of the annealing (default: a drawn seed, recorded in tree.seed)
+    @param: executor -> thread or process executor running the annealing chunks (default: event loop executor)
+    @param: chunk -> number of iterations run in the executor between two awaits
+    @param: progress -> queue receiving {"temperature", "best_cost", "improved"} after every chunk (default: no queue)
+    @param: init_method -> constructive method of the initial floorplan (see sa.sa_initial_state)
+    @return: tree -> final state of the floorplan
+    @addition: Cancelling the task stops the annealing between two chunks
+    @addition: Use a process executor to run many placements in parallel
+    """
+    modules, cache, seed, rng = placement_setup(circuit, cache_size, seed)
+
+    # placement of the modules
+    tree = None
+
+    async for tree, cost, temperature, improved in sa.async_simulated_annealing(modules, circuit.port, INIT_TEMP, STOP_TEMP, ITERATION, time_budget, cache, init_method, rng, executor, chunk):
+        logger.debug("Placement progress... temperature: %.3f best cost: %s", temperature, cost)
+
+        if progress is not None:
+            await progress.put({"temperature": temperature, "best_cost": cost, "improved": improved})
+
+    return placement_finish(circuit, tree, cache, seed)
+
+
+def batch_placement(tech: Tech, circuits: list, max_workers: int=None, time_budget: float=None, init_method: str="shelf", seed: int=None):
+    """
+    @brief: device and port placement of many independent circuits in a process pool
     @param: tech -> Technology object
+    @param: circuits -> list of Circuit objects
+    @param: max_workers -> number of worker processes (default: number of CPUs)
+    @param: time_budget -> wall-clock budget of each annealing in seconds (default: no budget)
+    @param: init_method -> constructive method of the initial floorplan (see sa.sa_initial_state)
+    @param: seed -> random seed of the batch, each job gets its own seed drawn from it (default: each job draws a seed)
+    @yield: (circuit, report, error) -> as soon as the circuit is placed
+                                        report -> {"elapsed", "seed", "hits", "misses"} (None on error)
+                                        error  -> exception of the job (None on success)
+    @addition: The largest jobs (by group count) are submitted first and each idle worker
+               gets the next job, so the batch ends in about max(job) time
+    @addition: A worker that crashes only fails its own job, the other running jobs are
+               rerun one at a time in a new pool to find out which one crashed it
+    @addition: Closing the generator early only waits for the running jobs
+    """
+    # seed of each job, drawn in the given order so that the same batch gets the same seeds
+    batch_rng = random.Random(seed)
+    tasks = [(circuit, batch_rng.randrange(2**63) if seed is not None else None) for circuit in circuits]
+
+    # estimate the cost of each job from the group count, largest first
+    pending  = collections.deque(sorted(tasks, key=lambda task: len(task[0].group), reverse=True))
+
+    # jobs running when a worker crashed, each one is rerun alone
+    suspects = collections.deque()
+
+    # keep only one job per worker in flight, so an abandoned batch has nothing queued
+    workers  = max_workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers)
+    jobs     = {}
+
+    def submit_jobs() -> list:
+        """
+        @brief: submit the next jobs to the idle workers
+        @return: errors -> (circuit, error) of the circuits that cannot be submitted
+        """
+        errors = []
+
+        while True:
+            # a suspect runs alone in the pool
+            if suspects:
+                if jobs:
+                    break
+                task, suspect = suspects.popleft(), True
+            elif pending and len(jobs) < workers and not any(suspect for _, suspect in jobs.values()):
+                task, suspect = pending.popleft(), False
+            else:
+                break
+
+            # a circuit that cannot be submitted does not affect the others
+            circuit, job_seed = task
+            try:
+                job = executor.submit(placement_job, get_modules(circuit), circuit.port, time_budget, init_method=init_method, seed=job_seed)
+            except Exception as error:
+                errors.append((circuit, error))
+            else:
+                jobs[job] = (task, suspect)
+
+        return errors
+
+    try:
+        while True:
+            # submit the next (largest) jobs to the idle workers
+            for circuit, error in submit_jobs():
+                yield circuit, None, error
+
+            if not jobs:
+                break
+
+            # wait for the next jobs to finish
+            done, _ = wait(jobs, return_when=FIRST_COMPLETED)
+            finished = [(job, jobs.pop(job)[0]) for job in done]
+            broken   = [(job, task) for job, task in finished if isinstance(job.exception(), BrokenProcessPool)]
+
+            # a crashed worker breaks the pool and fails every running job, start a new pool
+            if broken:
+                rest, _ = wait(jobs)
+                broken += [(job, jobs.pop(job)[0]) for job in rest]
+
+                executor.shutdown(wait=True, cancel_futures=True)
+                executor = ProcessPoolExecutor(max_workers=workers)
+
+                # a job running alone crashed the worker, otherwise rerun the running jobs one at a time
+                if len(broken) == 1:
+                    job, (circuit, _) = broken[0]
+                    yield circuit, None, job.exception()
+                else:
+                    suspects.extend(task for _, task in broken)
+
+            # keep the workers busy before applying the results in the parent
+            for circuit, error in submit_jobs():
+                yield circuit, None, error
+
+            # apply the results of the finished jobs
+            for job, (circuit, _) in finished:
+                if isinstance(job.exception(), BrokenProcessPool):
+                    continue
+
+                # a failing job does not affect the others
+                try:
+                    modules, report = job.result()
+                    update_layout(circuit, modules)
+                    port_placement(tech, circuit)
+                except Exception as error:
+                    yield circuit, None, error
+                else:
+                    lookups = report["hits"] + report["misses"]
+                    logger.info("Transposition Cache... hit rate: %.3f hits: %d misses: %d", report["hits"] / lookups if lookups else 0.0, report["hits"], report["misses"])
+                    yield circuit, report, None
+    finally:
+        # an abandoned batch (consumer stopped or raised) only waits for the running jobs
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def placement_job(modules: list, ports: dict, time_budget: float=None, cache_size: int=4096, init_method: str="shelf", seed: int=None) -> tuple:
+    """
+    @brief: placement of the modules of one circuit (run in a worker process)
+    @param: modules -> modules to be placed
+    @param: ports -> I/O ports constraints
+    @param: time_budget -> wall-clock budget of the annealing in seconds (default: no budget)
+    @param: cache_size -> number of evaluated states kept in the cost cache
+    @param: init_method -> constructive method of the initial floorplan (see sa.sa_initial_state)
+    @param: seed -> random seed of the annealing (default: a drawn seed, returned in the report)
+    @return: (modules, report) -> placed modules (detached from the tree) and
+                                  {"elapsed": run time in seconds, "seed", "hits", "misses": cost cache statistics}
+    """
+    start = time.perf_counter()
+
+    # forked workers share the parent random state, use an own generator for each job
+    seed = placement_seed(seed)
+    rng  = random.Random(seed)
+
+    # placement of the modules
+    cache = sa.TranspositionCache(cache_size)
+    tree = sa.optimal_simulated_annealing(modules, ports, INIT_TEMP, STOP_TEMP, ITERATION, time_budget, cache, init_method, rng)
+
+    # return only the name, size and position of the modules
+    placed = []
+    for module in tree.get_modules():
+        node = BStarTreeNode(module.name, module.width, module.height)
+        node.x = module.x
+        node.y = module.y
+        placed.append(node)
+
+    report = {
+        "elapsed": time.perf_counter() - start,
+        "seed":    seed,
+        "hits":    cache.hits,
+        "misses":  cache.misses,
+    }
+
+    return placed, report
+
+
+def placement_seed(seed: int=None) -> int:
+    """
+    @brief: get a concrete random seed for a placement, so that it can always be reproduced
+    @param: seed -> requested seed (default: draw one from the OS entropy)
+    @return: seed -> the requested seed or a drawn one in [0, 2**63)
+    """
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**63)
+
+    return seed
+
+
+def placement_setup(circuit: Circuit, cache_size: int=4096, seed: int=None) -> tuple:
+    """
+    @brief: prepare the placement of the instances (shared by device_placement and async_device_placement)
     @param: circuit -> Circuit object
+    @param: cache_size -> number of evaluated states kept in the cost cache
+    @param: seed -> random seed of the annealing (default: a drawn seed)
+    @return: (modules, cache, seed, rng) -> modules of the instances, cost cache, concrete seed and
+                                            own random generator (the global random state is left untouched)
+    """
+    seed = placement_seed(seed)
+    rng  = random.Random(seed)
+
+    # get the modules of the instances
+    modules = get_modules(circuit)
+    cache   = sa.TranspositionCache(cache_size)
+
+    return modules, cache, seed, rng
+
+
+def placement_finish(circuit: Circuit, tree: BStarTree, cache: sa.TranspositionCache, seed: int) -> BStarTree:
+    """
+    @brief: apply the final state of the floorplan to the instances
+    @param: circuit -> Circuit object
+    @param: tree -> final state of the floorplan
+    @param: cache -> cost cache of the annealing
+    @param: seed -> random seed of the annealing, recorded in tree.seed
+    @return: tree -> final state of the floorplan
+    """
+    # pack the final state (cached cost evaluations skip the packing)
+    tree.update_floorplan()
+    tree.seed = seed
+
+    logger.info("Transposition Cache... hit rate: %.3f hits: %d misses: %d", cache.hit_rate(), cache.hits, cache.misses)
+
+    # update the instance layout
+    update_layout(circuit, tree.get_modules())
+
+    return tree
+
+
+def get_modules(circuit: Circuit) -> list:
+    """
+    @brief: get the B*-tree modules of the instances
+    @param: circuit -> Circuit object
+    @return: modules -> list of B*-tree nodes
     """
     modules = []
 
@@ -22,11 +294,17 @@ def device_placement(circuit: Circuit) -> None:
         # create the bstar tree node
         modules.append(BStarTreeNode(group_id, width, height, copy.deepcopy(inst.pin)))
 
-    # placement of the modules
-    tree = sa.optimal_simulated_annealing(modules, circuit.port, 100, 1, 10000) # orig 20000
+    return modules
+
 
+def update_layout(circuit: Circuit, modules: list) -> None:
+    """
+    @brief: update the floorplan size and the instance layout from the placed modules
+    @param: circuit -> Circuit object
+    @param: modules -> placed B*-tree nodes
+    """
     # get width and height of the floorplan
-    for module in tree.get_modules():
+    for module in modules:
         # if module x1 larger than width, update width
         if module.x + module.width > circuit.width:
             circuit.width = module.x + module.width
@@ -35,10 +313,10 @@ def device_placement(circuit: Circuit) -> None:
         if module.y + module.height > circuit.height:
             circuit.height = module.y + module.height
 
-    print("Update Floorplan... width:", circuit.width, "height:", circuit.height)
+    logger.info("Update Floorplan... width: %s height: %s", circuit.width, circuit.height)
 
     # update the instance layout
-    for module in tree.get_modules():
+    for module in modules:
         inst = circuit.group[module.name]
 
         # get the reference position by subtracting the movement from the original position
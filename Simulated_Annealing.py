@@ -1,93 +1,358 @@
+import asyncio
 import random
 import copy
 import math
+import time
+from collections import OrderedDict
 from Device_Placer.BStarTree import BStarTree
 
-def simulated_annealing(modules: list, ports: list, init_temp: int, stop_temp: int, iteration: int=1000) -> BStarTree:
+__all__ = ["TranspositionCache",
+           "simulated_annealing", "optimal_simulated_annealing", "anytime_simulated_annealing",
+           "async_simulated_annealing", "async_optimal_simulated_annealing",
+           "sa_initial_state", "sa_cost", "sa_perturb"]
+
+class TranspositionCache:
+    def __init__(self, size: int=4096):
+        self.size   = size
+        self.cost   = OrderedDict()
+
+        self.hits   = 0
+        self.misses = 0
+
+    def get(self, key: int) -> float:
+        """
+        @brief: Get the cost of an evaluated state
+        @param: key -> zobrist hash of the state
+        @return: cost -> cost of the state (None if the state is not cached)
+        """
+        if key in self.cost:
+            self.hits += 1
+            self.cost.move_to_end(key)
+            return self.cost[key]
+        else:
+            self.misses += 1
+            return None
+
+    def put(self, key: int, cost: float) -> None:
+        """
+        @brief: Store the cost of an evaluated state (least recently used state is evicted)
+        @param: key -> zobrist hash of the state
+        @param: cost -> cost of the state
+        """
+        self.cost[key] = cost
+        self.cost.move_to_end(key)
+
+        if len(self.cost) > self.size:
+            self.cost.popitem(last=False)
+
+    def hit_rate(self) -> float:
+        """
+        @brief: Get the ratio of the lookups served by the cache
+        @return: hit_rate -> hits / lookups (0 if no lookup)
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def simulated_annealing(modules: list, ports: list, init_temp: int, stop_temp: int, iteration: int=1000, cache: TranspositionCache=None, init_method: str="shelf", rng: random.Random=random) -> BStarTree:
     """
     @brief: Floorplan Simulated Annealing Algorithm
     @param: modules -> modules to be placed
     @param: init_temp  -> initial temperature
     @param: stop_temp  -> stop temperature
     @param: iteration  -> number of iterations
+    @param: cache -> cost cache of the evaluated states (default: no cache)
+    @param: init_method -> constructive method of the initial floorplan (see sa_initial_state)
+    @param: rng -> random generator of the annealing (default: global random module)
     @return: current_state -> final state of the floorplan
     """
-    # initialize the temperature value and cooling rate
-    temperature = init_temp
-    cooling_rate = (init_temp - stop_temp)/iteration
-
-    # initialize the current state and cost
-    current_state = sa_initial_state(modules)
-    current_cost  = sa_cost(current_state, ports)
+    annealing = sa_anneal_init(modules, ports, init_temp, stop_temp, iteration, None, cache, init_method, rng)
 
     # iterate for the specified number of iterations
-    while temperature > stop_temp:
-        # update the state and cost
-        new_state = sa_perturb(current_state)
-        new_cost  = sa_cost(new_state, ports)
-
-        # calculate the cost difference
-        delta = new_cost - current_cost
+    while sa_anneal_running(annealing):
+        sa_anneal_step(annealing, ports)
 
-        # accept the new state based on the probability
-        if delta < 0 or random.random() < math.exp(-delta/temperature):
-            current_state = new_state
-            current_cost  = new_cost
-
-        # cooling schedule
-        temperature -= cooling_rate
+    # pack the current state (cached cost evaluations skip the packing)
+    current_state = annealing["current_state"]
+    current_state.update_floorplan()
 
     # return the current state
     return current_state
 
-def optimal_simulated_annealing(modules: list, ports: dict, init_temp: int, stop_temp: int, iteration: int=1000) -> BStarTree:
+def optimal_simulated_annealing(modules: list, ports: dict, init_temp: int, stop_temp: int, iteration: int=1000, time_budget: float=None, cache: TranspositionCache=None, init_method: str="shelf", rng: random.Random=random) -> BStarTree:
     """
     @brief: Floorplan Simulated Annealing Algorithm
     @param: modules -> modules to be placed
     @param: init_temp  -> initial temperature
     @param: stop_temp  -> stop temperature
     @param: iteration  -> number of iterations
-    @return: current_state -> final state of the floorplan
+    @param: time_budget -> wall-clock budget in seconds (default: no budget)
+    @param: cache -> cost cache of the evaluated states (default: no cache)
+    @param: init_method -> constructive method of the initial floorplan (see sa_initial_state)
+    @param: rng -> random generator of the annealing (default: global random module)
+    @return: best_state -> best state of the floorplan
     """
-    # initialize the temperature value and cooling rate
-    temperature = init_temp
-    cooling_rate = (init_temp - stop_temp)/iteration
-    best_cost = float('inf')
+    best_state = None
 
-    # initialize the current state and cost
-    current_state = sa_initial_state(modules)
-    current_cost  = sa_cost(current_state, ports)
+    # run the annealing to the end (or the time budget), keeping the last (best) state
+    for best_state, _ in anytime_simulated_annealing(modules, ports, init_temp, stop_temp, iteration, time_budget, cache, init_method, rng):
+        pass
 
-    # iterate for the specified number of iterations
-    while temperature > stop_temp:  
-        # update the state and cost
-        new_state = sa_perturb(current_state)
-        new_cost  = sa_cost(new_state, ports)
-
-        # calculate the cost difference
-        delta = new_cost - current_cost
-
-        # accept the new state based on the probability
-        if delta < 0 or random.random() < math.exp(-delta/temperature):
-            current_state = new_state
-            current_cost  = new_cost
-        
-        # capture the best state
-        if current_cost < best_cost:
-            best_state = current_state
-            best_cost = current_cost
+    # pack the best state (cached cost evaluations skip the packing)
+    best_state.update_floorplan()
+
+    # return the best state
+    return best_state
 
-        # cooling schedule
-        temperature -= cooling_rate
+
+def anytime_simulated_annealing(modules: list, ports: dict, init_temp: int, stop_temp: int, iteration: int=1000, time_budget: float=None, cache: TranspositionCache=None, init_method: str="shelf", rng: random.Random=random):
+    """
+    @brief: Anytime Floorplan Simulated Annealing Algorithm
+    @param: modules -> modules to be placed
+    @param: init_temp  -> initial temperature
+    @param: stop_temp  -> stop temperature
+    @param: iteration  -> number of iterations
+    @param: time_budget -> wall-clock budget in seconds (default: no budget)
+    @param: cache -> cost cache of the evaluated states (default: no cache)
+    @param: init_method -> constructive method of the initial floorplan (see sa_initial_state)
+    @param: rng -> random generator of the annealing (default: global random module)
+    @yield: (best_state, best_cost) -> every time a better state is found
+    @addition: Stops at the stop temperature or once the time budget runs out,
+               whichever comes first; the last yielded state is the best one
+    """
+    annealing = sa_anneal_init(modules, ports, init_temp, stop_temp, iteration, time_budget, cache, init_method, rng)
+
+    # the initial state is the first best state
+    yield annealing["best_state"], annealing["best_cost"]
+
+    # iterate for the specified number of iterations (or until the deadline)
+    while sa_anneal_running(annealing):
+        # report the best state
+        if sa_anneal_step(annealing, ports):
+            yield annealing["best_state"], annealing["best_cost"]
+
+
+async def async_simulated_annealing(modules: list, ports: dict, init_temp: int, stop_temp: int, iteration: int=1000, time_budget: float=None, cache: TranspositionCache=None, init_method: str="shelf", rng: random.Random=None, executor=None, chunk: int=500):
+    """
+    @brief: Anytime Floorplan Simulated Annealing Algorithm for asyncio
+    @param: modules -> modules to be placed
+    @param: init_temp  -> initial temperature
+    @param: stop_temp  -> stop temperature
+    @param: iteration  -> number of iterations
+    @param: time_budget -> wall-clock budget in seconds (default: no budget)
+    @param: cache -> cost cache of the evaluated states (default: no cache)
+    @param: init_method -> constructive method of the initial floorplan (see sa_initial_state)
+    @param: rng -> random generator of the annealing (default: new unseeded random.Random)
+    @param: executor -> thread or process executor running the chunks (default: event loop executor)
+    @param: chunk -> number of iterations run in the executor between two awaits
+    @yield: (best_state, best_cost, temperature, improved) -> after the initial state and after every chunk
+    @addition: The initial state and every chunk run in the executor (sa_anneal_init, sa_anneal_chunk)
+               with the annealing state sent along, so a process executor runs many placements
+               in parallel; the annealing can be cancelled between chunks (a running chunk
+               finishes in the background)
+    """
+    loop = asyncio.get_running_loop()
+
+    # the deadline is kept on the monotonic clock of this process (each chunk gets the remaining budget)
+    deadline = time.monotonic() + time_budget if time_budget is not None else float('inf')
+
+    # the global random module cannot be sent to a process, use an own generator
+    if rng is None:
+        rng = random.Random()
+
+    # initialize the annealing (initial floorplan and cost) in the executor
+    annealing = await loop.run_in_executor(executor, sa_anneal_init, modules, ports, init_temp, stop_temp, iteration, None, cache, init_method, rng)
+    annealing["deadline"] = deadline
+    sa_anneal_cache(annealing, cache)
+
+    # the initial state is the first best state
+    yield annealing["best_state"], annealing["best_cost"], annealing["temperature"], True
+
+    # iterate chunk by chunk for the specified number of iterations (or until the deadline)
+    while sa_anneal_running(annealing):
+        best_cost = annealing["best_cost"]
+        annealing = await loop.run_in_executor(executor, sa_anneal_chunk, annealing, ports, chunk, deadline - time.monotonic())
+        annealing["deadline"] = deadline
+        sa_anneal_cache(annealing, cache)
+
+        # report the progress of the chunk
+        yield annealing["best_state"], annealing["best_cost"], annealing["temperature"], annealing["best_cost"] < best_cost
+
+
+async def async_optimal_simulated_annealing(modules: list, ports: dict, init_temp: int, stop_temp: int, iteration: int=1000, time_budget: float=None, cache: TranspositionCache=None, init_method: str="shelf", rng: random.Random=None, executor=None, chunk: int=500) -> BStarTree:
+    """
+    @brief: Floorplan Simulated Annealing Algorithm for asyncio
+    @param: modules -> modules to be placed
+    @param: init_temp  -> initial temperature
+    @param: stop_temp  -> stop temperature
+    @param: iteration  -> number of iterations
+    @param: time_budget -> wall-clock budget in seconds (default: no budget)
+    @param: cache -> cost cache of the evaluated states (default: no cache)
+    @param: init_method -> constructive method of the initial floorplan (see sa_initial_state)
+    @param: rng -> random generator of the annealing (default: new unseeded random.Random)
+    @param: executor -> thread or process executor running the chunks (default: event loop executor)
+    @param: chunk -> number of iterations run in the executor between two awaits
+    @return: best_state -> best state of the floorplan
+    """
+    best_state = None
+
+    # run the annealing to the end (or the time budget), keeping the last (best) state
+    async for best_state, *_ in async_simulated_annealing(modules, ports, init_temp, stop_temp, iteration, time_budget, cache, init_method, rng, executor, chunk):
+        pass
+
+    # pack the best state (cached cost evaluations skip the packing)
+    best_state.update_floorplan()
 
     # return the best state
     return best_state
 
 
-def sa_initial_state(modules: list) -> BStarTree:
+def sa_anneal_init(modules: list, ports: dict, init_temp: int, stop_temp: int, iteration: int, time_budget: float, cache: TranspositionCache, init_method: str, rng: random.Random) -> dict:
+    """
+    @brief: Initialize the annealing state
+    @param: modules -> modules to be placed
+    @param: init_temp  -> initial temperature
+    @param: stop_temp  -> stop temperature
+    @param: iteration  -> number of iterations
+    @param: time_budget -> wall-clock budget in seconds (None: no budget)
+    @param: cache -> cost cache of the evaluated states (None: no cache)
+    @param: init_method -> constructive method of the initial floorplan (see sa_initial_state)
+    @param: rng -> random generator of the annealing
+    @return: annealing -> current and best states, schedule, cache and random generator
+    """
+    # initialize the current state and cost
+    current_state = sa_initial_state(modules, init_method)
+    current_cost  = sa_cost(current_state, ports, cache)
+
+    return {
+        "current_state": current_state,
+        "current_cost":  current_cost,
+        "best_state":    current_state,
+        "best_cost":     current_cost,
+        "temperature":   init_temp,
+        "stop_temp":     stop_temp,
+        "cooling_rate":  (init_temp - stop_temp)/iteration,
+        # monotonic clock of this process (see sa_anneal_chunk for another process)
+        "deadline":      time.monotonic() + time_budget if time_budget is not None else float('inf'),
+        "cache":         cache,
+        "rng":           rng,
+    }
+
+
+def sa_anneal_running(annealing: dict) -> bool:
+    """
+    @brief: Check if the annealing has not reached the stop temperature or the deadline
+    @param: annealing -> annealing state (see sa_anneal_init)
+    """
+    return annealing["temperature"] > annealing["stop_temp"] and time.monotonic() < annealing["deadline"]
+
+
+def sa_anneal_step(annealing: dict, ports: dict) -> bool:
+    """
+    @brief: Run one iteration of the annealing
+    @param: annealing -> annealing state (see sa_anneal_init), updated in place
+    @param: ports -> I/O ports constraints
+    @return: True if a better state is found
+    """
+    rng = annealing["rng"]
+    temperature  = annealing["temperature"]
+    current_cost = annealing["current_cost"]
+    improved = False
+
+    # draw the acceptance probability first and turn it into the maximum acceptable cost
+    # random < exp(-delta/temperature)  <=>  new_cost < current_cost - temperature*log(random)
+    threshold = rng.random()
+    max_cost  = current_cost - temperature * math.log(threshold) if threshold > 0 else float('inf')
+
+    # update the state and cost (evaluation stops as soon as the cost exceeds the maximum)
+    new_state = sa_perturb(annealing["current_state"], rng)
+    new_cost  = sa_cost(new_state, ports, annealing["cache"], max_cost)
+
+    # accept the new state based on the probability
+    if new_cost < max_cost:
+        annealing["current_state"] = new_state
+        annealing["current_cost"]  = new_cost
+
+        # capture the best state
+        if new_cost < annealing["best_cost"]:
+            annealing["best_state"] = new_state
+            annealing["best_cost"]  = new_cost
+            improved = True
+
+    # cooling schedule
+    annealing["temperature"] = temperature - annealing["cooling_rate"]
+
+    return improved
+
+
+def sa_anneal_chunk(annealing: dict, ports: dict, chunk: int, time_left: float=None) -> dict:
+    """
+    @brief: Run a chunk of iterations of the annealing (can run in a worker process)
+    @param: annealing -> annealing state (see sa_anneal_init)
+    @param: ports -> I/O ports constraints
+    @param: chunk -> maximum number of iterations
+    @param: time_left -> remaining budget in seconds (default: keep the deadline of the state)
+    @return: annealing -> updated annealing state
+    @addition: Monotonic clocks are per process, so the caller passes the remaining budget
+               and the deadline is set again on the clock of the process running the chunk
+    """
+    if time_left is not None:
+        annealing["deadline"] = time.monotonic() + time_left
+
+    for _ in range(chunk):
+        if not sa_anneal_running(annealing):
+            break
+
+        sa_anneal_step(annealing, ports)
+
+    return annealing
+
+
+def sa_anneal_cache(annealing: dict, cache: TranspositionCache) -> None:
+    """
+    @brief: Keep the caller's cache up to date with the cache of the annealing state
+    @param: annealing -> annealing state (see sa_anneal_init), updated in place
+    @param: cache -> cost cache of the caller (None: no cache)
+    @addition: A process executor returns a copy of the cache
+    """
+    if cache is not None and annealing["cache"] is not cache:
+        cache.cost   = annealing["cache"].cost
+        cache.hits   = annealing["cache"].hits
+        cache.misses = annealing["cache"].misses
+        annealing["cache"] = cache
+
+
+def sa_initial_state(modules: list, method: str="shelf") -> BStarTree:
     """
     @brief: Initialize the state (initial floorplan)
     @param: modules -> list of modules to be placed
+    @param: method -> constructive method of the initial floorplan
+                      "shelf": height-sorted shelf packing (default)
+                      "connectivity": connectivity-ordered greedy shelf packing
+                      "chain": single row of modules hanging off modules[0]
+    @return: tree -> initial state of the floorplan
+    """
+    # detach the modules from any previous tree
+    for module in modules:
+        module.left = None
+        module.right = None
+        module.parent = None
+        module.key = 0
+
+    if method == "shelf":
+        return sa_shelf_state(sorted(modules, key=lambda module: module.height, reverse=True))
+    elif method == "connectivity":
+        return sa_shelf_state(sa_connectivity_order(modules))
+    elif method == "chain":
+        return sa_chain_state(modules)
+    else:
+        raise ValueError(f"unknown initial state method: {method}")
+
+
+def sa_chain_state(modules: list) -> BStarTree:
+    """
+    @brief: Initialize the state as a single row of modules
+    @param: modules -> list of modules to be placed
     @return: tree -> initial state of the floorplan
     """
     tree = BStarTree()
@@ -104,33 +369,99 @@ def sa_initial_state(modules: list) -> BStarTree:
     return tree
 
 
-def sa_cost(state: BStarTree, port: dict) -> float:
+def sa_shelf_state(modules: list) -> BStarTree:
+    """
+    @brief: Initialize the state by packing the modules row by row (shelves)
+    @param: modules -> list of modules to be placed, in packing order
+    @return: tree -> initial state of the floorplan
+    @addition: Each row is a left chain (modules side by side) and each row starts
+               at the right child (on top) of the first module of the row below,
+               the row width is about the side of a square of the total area
+    """
+    tree = BStarTree()
+
+    if not modules:
+        return tree
+
+    # target row width of the (square) floorplan
+    row_width = max(math.sqrt(sum(module.area for module in modules)), max(module.width for module in modules))
+
+    # first row starts at the root
+    tree.insert_root(modules[0])
+    row_first = modules[0]
+    row_last  = modules[0]
+    width     = modules[0].width
+
+    # iterate through the other modules
+    for module in modules[1:]:
+        # row is full, start a new row on top of the first module of the row
+        if width + module.width > row_width:
+            tree.insert_right(row_first, module)
+            row_first = module
+            width     = 0
+        # insert the module to the right of the last module of the row
+        else:
+            tree.insert_left(row_last, module)
+
+        row_last = module
+        width   += module.width
+
+    return tree
+
+
+def sa_connectivity_order(modules: list) -> list:
+    """
+    @brief: Order the modules greedily by connectivity
+    @param: modules -> list of modules to be placed
+    @return: order -> modules ordered so that each one shares the most nets with the previous ones
+    """
+    # get the nets of each module
+    nets = {id(module): set(pin.net for pin in module.pin) for module in modules}
+
+    # start from the module with the most nets (largest area on ties)
+    remaining = list(modules)
+    first = max(remaining, key=lambda module: (len(nets[id(module)]), module.area))
+    remaining.remove(first)
+    order = [first]
+    placed_nets = set(nets[id(first)])
+
+    # iterate by picking the module most connected to the placed modules
+    while remaining:
+        module = max(remaining, key=lambda module: (len(nets[id(module)] & placed_nets), module.area))
+        remaining.remove(module)
+        order.append(module)
+        placed_nets |= nets[id(module)]
+
+    return order
+
+
+def sa_cost(state: BStarTree, port: dict, cache: TranspositionCache=None, max_cost: float=float('inf')) -> float:
     """
     @brief: Calculate the cost of the current state
     @param: state -> current state of the floorplan (B*-tree)
     @param: ports -> list of I/O ports constraints
+    @param: cache -> cost cache of the evaluated states (default: no cache)
+    @param: max_cost -> stop the evaluation once the cost exceeds it (default: no limit)
     @return: area -> area of the floorplan
+    @addition: A cached state is not packed (module coordinates are left as they are)
+    @addition: A stopped evaluation returns a lower bound of the cost (larger than max_cost)
     """
-    # update the floorplan
-    state.update_floorplan()
+    # skip the evaluation of an already evaluated state
+    if cache is not None:
+        cost = cache.get(state.hash)
+        if cost is not None:
+            return cost
 
-    # initialization of the width, height, HPWL
-    width, height = 0, 0
-    hpwl = []
-    
-    # get the modules and nets of the floorplan
-    modules = state.get_modules()
-    net = state.get_nets()
+    # update the floorplan (stop once the area of the packed modules is a too large lower bound)
+    if not state.update_floorplan(2 * max_cost):
+        return state.width * state.height * 0.5
 
-    # iterate through the modules to get the width and height of the floorplan
-    for module in modules:
-        # if module x1 larger than width, update width
-        if module.x + module.width > width:
-            width = module.x + module.width
-        
-        # if module y1 larger than height, update height
-        if module.y + module.height > height:
-            height = module.y + module.height
+    # get the width and height of the floorplan
+    width, height = state.width, state.height
+    hpwl = 0
+
+    # get the nets of the floorplan
+    net = state.get_nets()
 
     # calculate the area of the floorplan
     area = width * height
@@ -166,21 +497,32 @@ def sa_cost(state: BStarTree, port: dict) -> float:
             y.append((coor[3] - coor[1])/2 + coor[1])
 
         # calculate the HPWL
-        hpwl.append(max(x) - min(x) + max(y) - min(y))
+        hpwl += max(x) - min(x) + max(y) - min(y)
+
+        # stop once the partial cost exceeds the maximum
+        if (hpwl * 0.5) + (area * 0.5) > max_cost:
+            return (hpwl * 0.5) + (area * 0.5)
     
+    # calculate the cost of the floorplan
+    cost = (hpwl * 0.5) + (area * 0.5)
+
+    if cache is not None:
+        cache.put(state.hash, cost)
+
     # return the cost of the floorplan
-    return (sum(hpwl) * 0.5) + (area * 0.5)
+    return cost
 
 
-def sa_perturb(state: BStarTree) -> BStarTree:
+def sa_perturb(state: BStarTree, rng: random.Random=random) -> BStarTree:
     """
     @brief: Perturb the current state
     @param: state -> current state of the floorplan (B*-tree)
+    @param: rng -> random generator (default: global random module)
     @return: new_state -> new state of the floorplan 
     """
     new_state = copy.deepcopy(state)
     modules   = new_state.get_modules()
-    operation = random.randint(1,2)
+    operation = rng.randint(1,2)
 
     # Return if only one module, no operation can be performed
     if len(modules) == 1:
@@ -199,8 +541,8 @@ def sa_perturb(state: BStarTree) -> BStarTree:
 
         # randomly select two nodes to swap
         while node1 == node2:
-            node1 = random.randint(0,len(modules)-1)
-            node2 = random.randint(0,len(modules)-1)
+            node1 = rng.randint(0,len(modules)-1)
+            node2 = rng.randint(0,len(modules)-1)
 
         new_state.swap(modules[node1],modules[node2])
 
@@ -213,10 +555,10 @@ def sa_perturb(state: BStarTree) -> BStarTree:
 
         # randomly select two nodes and a direction to move
         while node1 == node2:
-            node1 = random.randint(0,len(modules)-1)
-            node2 = random.randint(0,len(modules)-1)
-            direction = random.randint(0,1)
+            node1 = rng.randint(0,len(modules)-1)
+            node2 = rng.randint(0,len(modules)-1)
+            direction = rng.randint(0,1)
 
-        new_state.move(modules[node1],modules[node2],child[direction])
+        new_state.move(modules[node1],modules[node2],child[direction],rng)
 
     return new_state
\ No newline at end of file
@@ -1,3 +1,4 @@
 from Device_Placer.BStarTree import *
 from Device_Placer.Simulated_Annealing import *
-from Device_Placer.Placer import *
\ No newline at end of file
+from Device_Placer.Placer import *
+from Device_Placer.Placement_File import *
\ No newline at end of file